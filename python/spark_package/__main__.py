@@ -0,0 +1,4 @@
+from spark_package.spark_package import main
+
+if __name__ == '__main__':
+    main()
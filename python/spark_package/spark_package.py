@@ -9,37 +9,41 @@ Spark Packages. Major functionalities provided by this tool:
 """
 
 import datetime
+import functools
+import importlib.resources
 import optparse
 import os
 import re
 import zipfile
-import fnmatch
+import itertools
+import struct
 import xml.etree.ElementTree as Xml
-import xml.dom.minidom as dom
 import tempfile
 import shutil
 import base64
-import requests
 import subprocess
-import sys
-if sys.version_info >= (3, 0):
-    from io import StringIO
-else:
-    from StringIO import StringIO
 from getpass import getpass
-from pkg_resources import resource_string
-from builtins import input
 
 # <----- zip Methods ------>
 
+# Size of the write buffer used for the jar and zip archives
+zip_buffer_size = 512 * 1024
+# Size of the chunks used when copying entries from an existing jar
+copy_buffer_size = 256 * 1024
+# Directories that are not searched for the package jar. These hold the jars it depends on.
+excluded_jar_dirs = frozenset(['lib'])
+# Directories under python/ that are not added to the jar
+excluded_python_dirs = frozenset(['bin', 'doc', 'docs', '.git', 'lib', '__pycache__'])
+
+
 def validate_files_exist(root_dir):
     """
     Checks if the required files (LICENSE, README, pom) exist
     """
-    files = os.listdir(root_dir)
+    files = set(os.listdir(root_dir))
     if 'README.md' not in files:
         show_error_and_exit('Cannot find README.md in the root directory of the package.')
-    if not get_license_file_name(root_dir):
+    if not get_license_file_name(files):
         show_error_and_exit('Cannot find LICENSE in the root directory of the package.')
 
 
@@ -83,25 +87,115 @@ def prepare_pom(root_dir, name, version, out_dir):
     # the pom
     sp_deps_path = os.path.join(root_dir, 'python', 'spark-package-deps.txt')
     if os.path.isfile(sp_deps_path):
-        sp_deps = open(sp_deps_path, 'r')
-        for line in sp_deps.readlines():
-            line = line.strip()
-            if not line.startswith('#'):
-                dep_group_id, dep_artifact_id, dep_version = validate_and_return_sp_dep(line)
-                dep = {"groupId": dep_group_id,
-                       "artifactId": dep_artifact_id,
-                       "version": dep_version}
-                keys = ["groupId", "artifactId"] # keys to compare on
-                pom_add_element(project, prefix, "dependencies", "dependency", dep, keys,
-                                ["groupId", "artifactId", "version"])
+        deps = []
+        with open(sp_deps_path, 'r') as sp_deps:
+            for line in sp_deps:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    dep_group_id, dep_artifact_id, dep_version = validate_and_return_sp_dep(line)
+                    deps.append({"groupId": dep_group_id,
+                                 "artifactId": dep_artifact_id,
+                                 "version": dep_version})
+        keys = ["groupId", "artifactId"] # keys to compare on
+        pom_add_elements(project, prefix, "dependencies", "dependency", deps, keys,
+                         ["groupId", "artifactId", "version"])
     repo = {"id": "SparkPackagesRepo",
            "name": "Spark Packages Repository",
            "url": "http://dl.bintray.com/spark-packages/maven/",
            "layout": "default"}
-    pom_add_element(project, prefix, "repositories", "repository", repo, ["url"],
-                    ["id", "name", "url", "layout"])
-    with open(os.path.join(out_dir, "%s-%s.pom" % (artifact_id, version)), 'w') as new_pom:
-        new_pom.write(pom_pretty_print(Xml.tostring(project, encoding='UTF-8')))
+    pom_add_elements(project, prefix, "repositories", "repository", [repo], ["url"],
+                     ["id", "name", "url", "layout"])
+    # Indent the tree in place and serialize it straight into the file
+    Xml.indent(project, space=' ' * 2)
+    with open(os.path.join(out_dir, "%s-%s.pom" % (artifact_id, version)), 'wb') as new_pom:
+        Xml.ElementTree(project).write(new_pom, encoding='UTF-8', xml_declaration=True)
+
+
+def find_jars(root_dir):
+    """
+    Yields the paths of the jars under root_dir, except for sbt and assembly jars and the jars in
+    lib/ directories. Uses scandir, so the entry types come from the directory listing instead of
+    a stat() per entry.
+    """
+    with os.scandir(root_dir) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in excluded_jar_dirs:
+                    yield from find_jars(entry.path)
+            elif entry.name.endswith('.jar') and 'sbt' not in entry.name and \
+                    'assembly' not in entry.name:
+                yield entry.path
+
+
+def copy_jar_entry_info(info):
+    """
+    Returns a new ZipInfo with the name, timestamp, permissions and compression of 'info'
+    """
+    entry = zipfile.ZipInfo(info.filename, info.date_time)
+    entry.compress_type = info.compress_type
+    if info.external_attr:
+        # external_attr only means something together with the host that wrote it, e.g. DOS
+        # attributes from a jar built on Windows
+        entry.create_system = info.create_system
+        entry.external_attr = info.external_attr
+    else:
+        # Jars built by the JDK, sbt or Maven carry no attributes at all. Give those entries the
+        # Unix mode zipfile gives new entries, also when they are copied raw, so they stay readable
+        entry.external_attr = 0o600 << 16
+    entry.file_size = info.file_size
+    return entry
+
+
+def copy_raw_jar_entry(old_jar_file, jar, info):
+    """
+    Copies the compressed bytes of an entry to 'jar' as they are, without decompressing and
+    compressing them again. 'old_jar_file' is the jar that 'info' belongs to, opened in binary
+    mode. zipfile has no public API for this, so the entry is added the way ZipFile.open(..., 'w')
+    adds one, except that the CRC and sizes are known upfront.
+    """
+    entry = copy_jar_entry_info(info)
+    entry.CRC = info.CRC
+    entry.compress_size = info.compress_size
+    # The local header of the source entry may have a different extra field than the central
+    # directory, so read its length there to find where the data starts
+    old_jar_file.seek(info.header_offset)
+    header = old_jar_file.read(zipfile.sizeFileHeader)
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    old_jar_file.seek(info.header_offset + zipfile.sizeFileHeader + name_length + extra_length)
+    with jar._lock:
+        jar.fp.seek(jar.start_dir)
+        entry.header_offset = jar.fp.tell()
+        jar._writecheck(entry)
+        jar._didModify = True
+        jar.fp.write(entry.FileHeader())
+        remaining = info.compress_size
+        while remaining > 0:
+            chunk = old_jar_file.read(min(remaining, copy_buffer_size))
+            if not chunk:
+                raise zipfile.BadZipFile("Truncated entry %s in %s" %
+                                         (info.filename, old_jar_file.name))
+            jar.fp.write(chunk)
+            remaining -= len(chunk)
+        jar.start_dir = jar.fp.tell()
+        jar.filelist.append(entry)
+        jar.NameToInfo[entry.filename] = entry
+
+
+def copy_jar_entries(old_jar_path, jar):
+    """
+    Copies the entries of the jar at old_jar_path to 'jar', keeping their order. Entries that
+    are already compressed the way 'jar' compresses them are copied without recompressing them.
+    Others are streamed in chunks, so that they are never held in memory whole.
+    """
+    with zipfile.ZipFile(old_jar_path) as old_jar, open(old_jar_path, 'rb') as old_jar_file:
+        for info in old_jar.infolist():
+            # Encrypted entries (flag bit 0) are left to zipfile
+            if info.compress_type == jar.compression and not info.flag_bits & 0x1:
+                copy_raw_jar_entry(old_jar_file, jar, info)
+            else:
+                with old_jar.open(info, 'r') as src, \
+                        jar.open(copy_jar_entry_info(info), 'w') as dst:
+                    shutil.copyfileobj(src, dst, copy_buffer_size)
 
 
 def prepare_jar(root_dir, artifact_name):
@@ -110,20 +204,17 @@ def prepare_jar(root_dir, artifact_name):
     directory, because that's how python can find those files. Only class files, LICENSE, README,
     and POM are added
     """
-    pwd = os.getcwd()
-    # A PyZipFile will package python binaries for us
-    jar = zipfile.PyZipFile(artifact_name + "jar", 'w')
-    os.chdir(root_dir)
-    files = os.listdir('.')
-    if os.path.isdir(os.path.join('src', 'main', 'scala')) or \
-        os.path.isdir(os.path.join('src', 'main', 'java')):
+    # A PyZipFile will package python binaries for us. The output goes through a large buffer, so
+    # that the compressed entries reach the disk in a few big writes rather than many small ones
+    jar_file = open(artifact_name + "jar", 'wb', buffering=zip_buffer_size)
+    jar = zipfile.PyZipFile(jar_file, 'w', zipfile.ZIP_DEFLATED)
+    files = set(os.listdir(root_dir))
+    if os.path.isdir(os.path.join(root_dir, 'src', 'main', 'scala')) or \
+        os.path.isdir(os.path.join(root_dir, 'src', 'main', 'java')):
         # Find the jar that was built, if there are any scala or java files.
         # Will omit any jars in lib/
-        existing_jars = []
-        for root, dirnames, filenames in os.walk('.'):
-            for filename in fnmatch.filter(filenames, '*.jar'):
-                if 'lib' not in filename and 'sbt' not in filename and 'assembly' not in filename:
-                    existing_jars.append(os.path.join(root, filename))
+        # We only need to know whether there are zero, one or more jars, so stop at the second one.
+        existing_jars = list(itertools.islice(find_jars(root_dir), 2))
         if len(existing_jars) == 0:
             show_error_and_exit("Your directory contains java or scala code but a jar could not "
                                 "be found. Please build your spark package before calling zip."
@@ -135,24 +226,27 @@ def prepare_jar(root_dir, artifact_name):
                                 " depends on."
                                 "\nIf there are dependency jars in your folder, please place them "
                                 "under lib/ and add them to your pom or sbt build file.")
-        old_jar = zipfile.ZipFile(existing_jars[0])
-        for f in old_jar.namelist():
-            old_jar_content = old_jar.open(f, 'r')
-            jar.writestr(f, old_jar_content.read())
-            old_jar_content.close()
-    jar.write(get_license_file_name('.'))
-    jar.write('README.md')
+        copy_jar_entries(existing_jars[0], jar)
+    # Paths are passed explicitly instead of changing the working directory, so that this doesn't
+    # touch any process wide state.
+    license_file = get_license_file_name(files)
+    jar.write(os.path.join(root_dir, license_file), arcname=license_file)
+    jar.write(os.path.join(root_dir, 'README.md'), arcname='README.md')
     if 'python' in files:
-        os.chdir(os.path.join('.', 'python'))
-        jar.writepy('.')
-        if os.path.isfile('requirements.txt'):
-            jar.write('requirements.txt')
-        python_dirs = [ p for p in os.listdir('.') if os.path.isdir(p) and 'bin' not in p
-                        and 'doc' not in p and '.git' not in p and 'lib' not in p ]
+        python_dir = os.path.join(root_dir, 'python')
+        jar.writepy(python_dir)
+        requirements = os.path.join(python_dir, 'requirements.txt')
+        if os.path.isfile(requirements):
+            jar.write(requirements, arcname='requirements.txt')
+        # DirEntry.is_dir() reuses the file type read with the directory listing, instead of
+        # calling stat() on every entry
+        with os.scandir(python_dir) as entries:
+            python_dirs = [ e.path for e in entries
+                            if e.is_dir() and e.name not in excluded_python_dirs ]
         for dir in python_dirs:
             jar.writepy(dir)
     jar.close()
-    os.chdir(pwd)
+    jar_file.close()
 
 
 def zip_artifact(root_dir, name, version, out_dir):
@@ -166,14 +260,13 @@ def zip_artifact(root_dir, name, version, out_dir):
     temp_artifact_name = os.path.join(temp_dir, artifact_name)
     prepare_jar(root_dir, temp_artifact_name)
     prepare_pom(root_dir, name, version, temp_dir)
-    pwd = os.getcwd()
     zip_path = os.path.join(out_dir, artifact_name + "zip")
-    artifact = zipfile.ZipFile(zip_path, 'w')
-    os.chdir(temp_dir)
-    artifact.write(artifact_name + "pom")
-    artifact.write(artifact_name + "jar")
+    artifact_file = open(zip_path, 'wb', buffering=zip_buffer_size)
+    artifact = zipfile.ZipFile(artifact_file, 'w')
+    artifact.write(temp_artifact_name + "pom", arcname=artifact_name + "pom")
+    artifact.write(temp_artifact_name + "jar", arcname=artifact_name + "jar")
     artifact.close()
-    os.chdir(pwd)
+    artifact_file.close()
     shutil.rmtree(temp_dir)
     print("Zip File created at: %s" % os.path.abspath(zip_path))
     return zip_path
@@ -204,10 +297,10 @@ def get_license_prompt():
 def create_license_file(license_id):
     file = 'LICENSE'
     if license_id == len(licenses):
-        res_file = resource_string('spark_package.resources', 'LICENSE').decode("utf-8")
+        res_file = read_resource('spark_package.resources', 'LICENSE')
     else:
-        res_file = resource_string('spark_package.resources.license_temps',
-                                   licenses[license_id - 1][0]).decode("utf-8")
+        res_file = read_resource('spark_package.resources.license_temps',
+                                 licenses[license_id - 1][0])
     f = open(file, 'w')
     f.write(res_file)
     f.close()
@@ -268,12 +361,17 @@ def init_r_directories(name, license_id):
     create_static_file(os.path.join("R", "pkg", "Read-and-delete-me"))
 
 
-def init_empty_package(base_dir, name, scala, java, python, r):
+def init_empty_package(base_dir, name, scala, java, python, r, license_id=None):
+    """
+    Creates the skeleton of a new package. The user is prompted for the license, unless
+    'license_id', the 1-based index of the license in 'licenses', is supplied.
+    """
     repo_name = name.split("/")[1]
     package_dir = os.path.join(base_dir, repo_name)
     if os.path.exists(package_dir):
         raise RuntimeError("Directory %s already exists" % package_dir)
-    license_id = get_license_id()
+    if license_id is None:
+        license_id = get_license_id()
     os.makedirs(package_dir)
     os.chdir(package_dir)
     create_license_file(license_id)
@@ -300,6 +398,25 @@ def init_empty_package(base_dir, name, scala, java, python, r):
 
 # <----- register Methods ------>
 
+# Shared by all requests to Spark Packages, so that connections are reused instead of doing a new
+# TLS handshake for every request
+http_session = None
+
+
+def get_http_session():
+    global http_session
+    if http_session is None:
+        # Imported here, as requests is by far the slowest import of this tool and only register
+        # and publish use it
+        import requests
+        http_session = requests.Session()
+        # Retry requests that fail to connect
+        adapter = requests.adapters.HTTPAdapter(max_retries=3)
+        http_session.mount('https://', adapter)
+        http_session.mount('http://', adapter)
+    return http_session
+
+
 def get_description(desc_prompt):
     desc_raw = input(desc_prompt).strip()
     if desc_raw == "":
@@ -318,7 +435,7 @@ def check_homepage(homepage):
     """
     Check if homepage exists, because users can't update a wrong link on the Spark Packages website.
     """
-    resp = requests.get(homepage)
+    resp = get_http_session().get(homepage)
     resp.raise_for_status()
 
 
@@ -328,9 +445,8 @@ def register_package_http(name, user, token, short_desc, long_desc, homepage):
               "homepage": homepage,
               "short_description": short_desc,
               "description": long_desc}
-    auth = base64.b64encode((user + ":" + token).encode())
-    h = {"Authorization": "Basic " + auth.decode("utf-8")}
-    return requests.post(url, headers=h, data=params)
+    h = get_auth_header(user, token)
+    return get_http_session().post(url, headers=h, data=params)
 
 
 def register_package(name, user, token):
@@ -353,34 +469,29 @@ def register_package(name, user, token):
 # <----- publish Methods ------>
 
 def publish_release(name, user, token, folder, version, out, zip):
-    auth = base64.b64encode((user + ":" + token).encode())
-    pwd = os.getcwd()
-    os.chdir(folder)
-    p = subprocess.Popen(["git", "rev-parse", "HEAD"], stdout=subprocess.PIPE)
-    sys_out, sys_err = p.communicate()
-    assert sys_out is not None, \
-        "Problem while accessing git commit sha. Is the folder also the local github repository?"
-    assert len(sys_out.strip()) != 0, \
-        "Problem while accessing git commit sha. Is the folder also the local github repository?"
-    git_sha1 = sys_out.strip()
+    try:
+        git_sha1 = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=folder,
+                                           universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        git_sha1 = ""
+    if len(git_sha1) == 0:
+        show_error_and_exit("Problem while accessing git commit sha. Is the folder also the local "
+                            "github repository?")
     # -1 because prompt is one based, whereas the website is zero based.
     license_id = get_license_id() - 1
-    os.chdir(pwd)
     if zip is None:
         zip = zip_artifact(folder, name, version, out)
-    binary_zip = ""
-    if zip is not None:
-        with open(zip, 'rb') as f:
-            binary_zip = base64.b64encode(f.read())
-    artifact_zip = StringIO(binary_zip.decode("utf-8"))
+    # The release endpoint expects the base64 encoded zip. requests accepts the encoded bytes as
+    # they are, so there is no need to decode them and wrap them in another buffer.
+    artifact_zip = encode_file_base64(zip)
     url = "https://spark-packages.org/api/submit-release"
     params = {"git_commit_sha1": git_sha1,
               "version": version,
               "license_id": license_id,
               "name": name}
     f = {"artifact_zip": artifact_zip}
-    h = {"Authorization": "Basic " + auth.decode("utf-8")}
-    resp = requests.post(url, headers=h, data=params, files=f)
+    h = get_auth_header(user, token)
+    resp = get_http_session().post(url, headers=h, data=params, files=f)
     if resp.status_code == 201:
         print("\nSUCCESS: %s" % resp.text)
     else:
@@ -388,6 +499,28 @@ def publish_release(name, user, token, folder, version, out, zip):
 
 # <----- util Methods ------>
 
+# Size of the chunks the release zip is base64 encoded in. Must be a multiple of 3, so that the
+# encoded chunks can be concatenated without padding in between.
+base64_chunk_size = 3 * 64 * 1024
+
+
+def get_auth_header(user, token):
+    auth = base64.b64encode((user + ":" + token).encode())
+    return {"Authorization": "Basic " + auth.decode("utf-8")}
+
+
+def encode_file_base64(path):
+    """
+    Returns the base64 encoding of the file at path. The file is read and encoded in chunks, so
+    that its raw contents are never held in memory next to the encoded copy.
+    """
+    encoded = bytearray()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(base64_chunk_size), b""):
+            encoded += base64.b64encode(chunk)
+    return encoded
+
+
 def get_license_id():
     license_id = int(input(get_license_prompt()))
     while license_id < 1 or license_id > len(licenses):
@@ -395,15 +528,16 @@ def get_license_id():
         license_id = int(input(get_license_prompt()))
     return license_id
 
-def get_license_file_name(root_dir):
-    files = os.listdir(root_dir)
-    if 'LICENSE' in files:
-        return 'LICENSE'
-    if 'LICENSE.txt' in files:
-        return 'LICENSE.txt'
-    if 'LICENSE.md' in files:
-        return 'LICENSE.md'
-    return None
+# Accepted names for the license file, in order of preference
+license_file_names = ('LICENSE', 'LICENSE.txt', 'LICENSE.md')
+
+
+def get_license_file_name(files):
+    """
+    Returns the name of the license file among 'files', the set of file names in the root
+    directory of the package, or None if there isn't one.
+    """
+    return next((name for name in license_file_names if name in files), None)
 
 
 def show_error_and_exit(msg, parser=None):
@@ -418,6 +552,10 @@ The name consists of two parts: :org_name/:repo_name.
 It is required that this name be the name of the
 github repository of this package."""
 
+# Each part of the name must be non-empty and only consist of letters, numbers, dashes and
+# underscores
+name_regex = re.compile(r'\A[a-zA-Z0-9_-]+\Z')
+
 
 def validate_name(name, p=None):
     """
@@ -431,7 +569,7 @@ def validate_name(name, p=None):
         show_error_and_exit("The name of the package must contain exactly one slash." +
                             name_template)
     for n in fields:
-        if not re.match('^[a-zA-Z0-9-_]*$', n):
+        if not name_regex.match(n):
             show_error_and_exit("The name of the package can only contain letters, numbers, "
                                 "dashes, underscores, and must contain a single slash." +
                                 name_template)
@@ -451,21 +589,11 @@ def validate_and_return_sp_dep(line):
     return second_split[0], second_split[1], version
 
 
-def pom_pretty_print(f):
-    return dom.parseString(f).toprettyxml(indent=' ' * 2, encoding='UTF-8')\
-        .decode("utf-8").strip('\n')
-
-
-def pom_check_if_child_exists(parent, prefix, values, comparison_tags):
-    for child in parent:
-        match = 0
-        for tag in comparison_tags:
-            key = child.find(prefix + tag)
-            if key.text == values[tag]:
-                match += 1
-        if match == len(comparison_tags):
-            return True
-    return False
+def pom_get_child_keys(parent, prefix, comparison_tags):
+    """
+    Returns the set of (value of tag for tag in comparison_tags) tuples of the children of parent
+    """
+    return set(tuple(child.findtext(prefix + tag) for tag in comparison_tags) for child in parent)
 
 
 def pom_add_or_modify_tag(root, tag, text, insert_index=None):
@@ -482,19 +610,28 @@ def pom_add_or_modify_tag(root, tag, text, insert_index=None):
     child.text = text
 
 
-def pom_add_element(root, prefix, parent, child, values, comparison_keys, key_order):
+def pom_add_elements(root, prefix, parent, child, elements, comparison_keys, key_order):
     """
-    Checks if an element (spark-package dependency or repository) exists, adds it if it doesn't.
-    'values' is a dictionary. 'comparison_keys' is a list of keys to compare on.
+    Checks if each element (spark-package dependency or repository) exists, adds it if it doesn't.
+    'elements' is a list of dictionaries. 'comparison_keys' is a list of keys to compare on. The
+    existing children are indexed once, so each check is a set lookup.
     """
+    if not elements:
+        return
     dependencies = root.find(prefix + parent)
     if dependencies is None:
         dependencies = Xml.Element(prefix + parent)
         root.append(dependencies)
-    if not pom_check_if_child_exists(dependencies, prefix, values, comparison_keys):
+    existing = pom_get_child_keys(dependencies, prefix, comparison_keys)
+    for values in elements:
+        key_values = tuple(values[key] for key in comparison_keys)
+        if key_values in existing:
+            continue
+        existing.add(key_values)
         dep = Xml.Element(prefix + child)
-        for key, value in sorted(values.items(), key=lambda i:key_order.index(i[0])):
-            pom_add_or_modify_tag(dep, prefix + key, value)
+        for key in key_order:
+            if key in values:
+                pom_add_or_modify_tag(dep, prefix + key, values[key])
         dependencies.append(dep)
 
 
@@ -502,14 +639,18 @@ def read_credentials_file(file):
     user = ""
     token = ""
     with open(file, 'r') as f:
-        content = [x.strip('\n') for x in f.readlines()]
-        for line in content:
-            if 'user=' in line:
-                str_line = line.strip()
-                user = str_line[len('user='):].strip()
-            elif 'password=' in line:
-                str_line = line.strip()
-                token = str_line[len('password='):].strip()
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            key, sep, value = line.partition('=')
+            if not sep:
+                continue
+            key = key.strip()
+            if key == 'user':
+                user = value.strip()
+            elif key == 'password':
+                token = value.strip()
     if user == "":
         show_error_and_exit("Could not resolve github username from the file: %s. Please make " \
                             "sure that it's supplied in its own line as,\nuser= $USERNAME" % file)
@@ -519,19 +660,27 @@ def read_credentials_file(file):
     return user, token
 
 
-def resolve_credentials(user, token, file):
+def resolve_credentials(user, token, file, input_fn=None, getpass_fn=None):
+    """
+    Returns the Github username and token from the arguments, the credentials file, or by
+    prompting for them. 'input_fn' and 'getpass_fn' replace input() and getpass() for the prompts.
+    """
+    if input_fn is None:
+        input_fn = input
+    if getpass_fn is None:
+        getpass_fn = getpass
     if file is not None:
         if os.path.isfile(file):
             return read_credentials_file(file)
     if user is None or len(user.strip()) == 0:
-        git_user = input("Please enter your Github username: ").strip()
+        git_user = input_fn("Please enter your Github username: ").strip()
     else:
         git_user = user
     if git_user == "":
         show_error_and_exit("Empty username provided!")
     if token is None or len(token.strip()) == 0:
-        git_token = getpass("Please enter your Github Personal access token with read:org " + \
-                            "permissions: ").strip()
+        git_token = getpass_fn("Please enter your Github Personal access token with read:org " + \
+                               "permissions: ").strip()
     else:
         git_token = token
     if git_token == "":
@@ -539,15 +688,20 @@ def resolve_credentials(user, token, file):
     return git_user, git_token
 
 
+@functools.lru_cache(maxsize=None)
+def read_resource(package, name):
+    """
+    Returns the contents of a template shipped with this tool. Templates don't change while the
+    tool runs, so each one is only read once.
+    """
+    return importlib.resources.files(package).joinpath(name).read_bytes().decode("utf-8")
+
+
 def create_static_file(file, permission=None, replacements=None):
     """
     Copies the static resource file to the newly created project.
     """
-    if os.path.sep in file:
-        file_name = file[file.rfind(os.path.sep):]
-    else:
-        file_name = file
-    res_file = resource_string('spark_package.resources', file_name).decode("utf-8")
+    res_file = read_resource('spark_package.resources', os.path.basename(file))
     if replacements is not None:
         for placeholder, value in replacements:
             res_file = res_file.replace(placeholder, value)
@@ -566,10 +720,13 @@ def check_path_exists(option):
 
 # <----- Main ------>
 
-def main():
+def main(args=None):
+    """
+    Runs the command line tool. 'args' defaults to the command line arguments (sys.argv[1:]).
+    """
     # Set up and parse command line options
     usage = "usage: %prog <init|zip|register|publish> [options]"
-    p = optparse.OptionParser(usage=usage)
+    p = optparse.OptionParser(usage=usage, prog="spark-package")
     p.add_option("--out", "-o", type="string", default=".", help="The output directory for the "
                                                                  "package")
     p.add_option("--name", "-n", type="string", help="The name of the package. " + name_template)
@@ -631,7 +788,7 @@ def main():
         "--zip", "-z", type="string",
         help="The zip file containing the release artifact, if it has been generated beforehand.")
     p.add_option_group(publish_options)
-    options, arguments = p.parse_args()
+    options, arguments = p.parse_args(args)
     if len(arguments) == 0:
         show_error_and_exit("Please specify an action, such as 'init', 'zip', 'register' or " + \
                             "'publish'", p)
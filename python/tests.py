@@ -1,226 +1,337 @@
-from os.path import join,isfile,isdir
+from os.path import join,isfile
 import re
 import shutil
-from spark_package.spark_package import licenses,register_package_http,check_homepage
+import socket
+from spark_package.spark_package import licenses,register_package_http,check_homepage,\
+    read_credentials_file, resolve_credentials, init_empty_package, encode_file_base64, \
+    base64_chunk_size
 import sys
-if sys.version_info >= (3, 0):
-    from io import StringIO
-else:
-    from StringIO import StringIO
+from io import StringIO
+from contextlib import redirect_stderr, redirect_stdout
+import base64
+import collections
+import compileall
+import concurrent.futures
+import itertools
+import mmap
+import os
 import subprocess
-import tempfile
-import unittest
+from unittest import mock
+import pytest
 import zipfile
-import responses
-import pexpect
+from spark_package import spark_package
 
-def run_cmd(cmd):
-    return subprocess.Popen(["spark-package"] + cmd, stdout=subprocess.PIPE,
-                            stdin=subprocess.PIPE, stderr=subprocess.PIPE, close_fds = True)
+@pytest.fixture(autouse=True)
+def network():
+    """
+    Keeps the tests off the network. Requests through requests are answered by the 'responses' mock
+    this yields, and any other attempt to resolve or connect a socket fails immediately.
+    """
+    # Imported here rather than at the top, so collecting the tests doesn't have to load it
+    import responses
+
+    def refuse(*args, **kwargs):
+        raise OSError("The tests must not use the network")
+
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as rsps, \
+            mock.patch.object(socket, "getaddrinfo", refuse), \
+            mock.patch.object(socket.socket, "connect", refuse):
+        yield rsps
+
+
+def invoke_cli(cmd, inputs=()):
+    """
+    Runs spark-package with the arguments 'cmd' in this process, rather than starting a new
+    interpreter for it. 'inputs' are the answers to the prompts of the tool, in order.
+    Returns the exit code and what the tool wrote to stdout and stderr.
+    """
+    answers = iter(inputs)
+    out = StringIO()
+    err = StringIO()
+
+    def answer(prompt=""):
+        out.write(prompt)
+        try:
+            return next(answers)
+        except StopIteration:
+            # This is what input() raises when stdin is closed
+            raise EOFError()
+
+    # init changes the working directory to the new package
+    cwd = os.getcwd()
+    try:
+        with mock.patch("builtins.input", answer), \
+                redirect_stdout(out), redirect_stderr(err):
+            spark_package.main(cmd)
+        returncode = 0
+    except SystemExit as e:
+        returncode = e.code or 0
+    finally:
+        os.chdir(cwd)
+    return returncode, out.getvalue(), err.getvalue()
 
 
 def spawn(cmd):
+    # Only the smoke test needs a pty, so only it pays for importing pexpect
+    import pexpect
     return pexpect.spawn(" ".join(["spark-package"] + cmd))
 
 
 def input_and_expect(p, vals):
     for prompt, input in vals:
-        if sys.version_info >= (3, 0):
-            p.expect(re.compile(prompt))
-        else:
-            p.expect(re.compile(prompt.decode('utf-8')))
+        p.expect(re.compile(prompt))
         if input:
             p.sendline(input)
 
 
-def communicate(p, val):
-    if type(val) is list:
-        # stdo = [p.stdout.readline().decode("utf-8")]
-        for input in val:
-            p.stdin.write(input)
-            p.stdin.flush()
-            # stdo.append(p.stdout.readline().decode("utf-8"))
-        return p.communicate()
-    if sys.version_info >= (3, 0):
-        return p.communicate(val.encode())
-    else:
-        return p.communicate(val)
-
-
-def check_sbt_files(test, temp_dir, name, exists=True):
-    base_name = name.split("/")[1]
-    if exists:
-        check_exists = test.assertTrue
-    else:
-        check_exists = test.assertFalse
-    check_exists(isdir(join(temp_dir, base_name, "project")))
-    check_exists(isfile(join(temp_dir, base_name, "project", "build.properties")))
-    check_exists(isfile(join(temp_dir, base_name, "project", "plugins.sbt")))
-    check_exists(isdir(join(temp_dir, base_name, "build")))
-    check_exists(isfile(join(temp_dir, base_name, "build", "sbt")))
-    check_exists(isfile(join(temp_dir, base_name, "build", "sbt-launch-lib.bash")))
-    build_file = join(temp_dir, base_name, "build.sbt")
-    check_exists(isfile(build_file))
-    if exists:
-        with open(build_file, 'r') as f:
-            test.assertTrue("spName := \"%s\"" % name in f.read())
-
-
-def check_scala_files(test, temp_dir, name, exists=True):
+def snapshot_tree(root):
+    """
+    Walks 'root' once and returns a dict from the relative path of every entry below it to whether
+    the entry is a directory, so that the checks below don't stat each path separately.
+    """
+    tree = {}
+    for dir_path, dir_names, file_names in os.walk(root):
+        rel_dir = os.path.relpath(dir_path, root)
+        for dir_name in dir_names:
+            tree[os.path.normpath(join(rel_dir, dir_name))] = True
+        for file_name in file_names:
+            tree[os.path.normpath(join(rel_dir, file_name))] = False
+    return tree
+
+
+# Entries init creates for each part of a package, as (is a directory, path in the package)
+layouts = {
+    "base": (
+        (False, ("LICENSE",)),
+        (False, ("README.md",)),
+        (False, (".gitignore",)),
+    ),
+    "sbt": (
+        (True, ("project",)),
+        (False, ("project", "build.properties")),
+        (False, ("project", "plugins.sbt")),
+        (True, ("build",)),
+        (False, ("build", "sbt")),
+        (False, ("build", "sbt-launch-lib.bash")),
+        (False, ("build.sbt",)),
+    ),
+    "scala": (
+        (True, ("src", "main", "scala")),
+        (True, ("src", "test", "scala")),
+    ),
+    "java": (
+        (True, ("src", "main", "java")),
+        (True, ("src", "test", "java")),
+    ),
+    "python": (
+        (True, ("python",)),
+        (False, ("python", "setup.py")),
+        (False, ("python", "setup.cfg")),
+        (False, ("python", "MANIFEST.in")),
+        (False, ("python", "requirements.txt")),
+        (False, ("python", "spark-package-deps.txt")),
+        (False, ("python", "tests.py")),
+    ),
+    "r": (
+        (True, ("R", "pkg", "R")),
+        (True, ("R", "pkg", "man")),
+        (True, ("R", "pkg", "data")),
+        (True, ("R", "pkg", "src")),
+        (False, ("R", "pkg", "NAMESPACE")),
+        (False, ("R", "pkg", "man", "documentation.Rd")),
+        (False, ("R", "pkg", "Read-and-delete-me")),
+        (False, ("R", "pkg", "DESCRIPTION")),
+    ),
+}
+
+
+def check_layout(tree, name, layout, exists=True):
+    """
+    Checks that every entry of layouts[layout] exists, with the right type, in the package 'name'
+    of the snapshot 'tree', or that none of them exist.
+    """
     base_name = name.split("/")[1]
-    if exists:
-        check_exists = test.assertTrue
-    else:
-        check_exists = test.assertFalse
-    check_exists(isdir(join(temp_dir, base_name, "src", "main", "scala")))
-    check_exists(isdir(join(temp_dir, base_name, "src", "test", "scala")))
+    for is_dir, path in layouts[layout]:
+        assert tree.get(join(base_name, *path)) == (is_dir if exists else None), path
 
 
-def check_base_files(test, temp_dir, name):
-    base_name = name.split("/")[1]
-    test.assertTrue(isfile(join(temp_dir, base_name, "LICENSE")))
-    test.assertTrue(isfile(join(temp_dir, base_name, "README.md")))
-    test.assertTrue(isfile(join(temp_dir, base_name, ".gitignore")))
+def file_contains(path, text):
+    """
+    Returns whether the file at 'path' contains 'text'. The file is searched through a memory map
+    rather than read and decoded.
+    """
+    with open(path, 'rb') as f:
+        # An empty file can't be mapped
+        if os.fstat(f.fileno()).st_size == 0:
+            return False
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as contents:
+            return contents.find(text.encode('utf-8')) != -1
+
+
+def check_exception(expect, result):
+    returncode, out, _ = result
+    assert returncode != 0
+    assert expect in out
+
+
+# First line of the LICENSE file written for each entry of licenses
+license_first_lines = (
+    "Apache License, Version 2.0",
+    "Copyright (c) <YEAR>, <OWNER>",
+    "Copyright (c) <YEAR>, <OWNER>",
+    "The GNU General Public License (GPL-2.0)",
+    "GNU GENERAL PUBLIC LICENSE",
+    "GNU Lesser General Public License",
+    "GNU LESSER GENERAL PUBLIC LICENSE",
+    "The MIT License (MIT)",
+    "Mozilla Public License, version 2.0",
+    "Eclipse Public License, Version 1.0 (EPL-1.0)",
+    "# Every Spark Package must have a license in order to be published. You may"
+)
+
+# (license id, name, url, first line of the LICENSE file) for every license init offers
+license_cases = tuple((i, name, url, first_line) for i, ((name, url), first_line)
+                      in enumerate(zip(licenses, license_first_lines), 1))
+
+
+# Absolute path of the installed script. subprocess can only start it with posix_spawn(), instead
+# of fork() and exec(), when it is given a path rather than a name to look up.
+spark_package_script = shutil.which("spark-package") or "spark-package"
+
+
+def run_cmd(cmd, inputs=()):
+    """
+    Runs the installed spark-package script with the arguments 'cmd' in a new process, answering
+    its prompts with 'inputs'. Returns the exit code.
+    """
+    # The output isn't inspected, so it goes straight to /dev/null instead of through pipes that
+    # would have to be drained. close_fds=True would rule out posix_spawn(). Descriptors are
+    # created non-inheritable, so leaving them open doesn't pass anything to the child.
+    p = subprocess.Popen([spark_package_script] + cmd, stdin=subprocess.PIPE,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, close_fds=False)
+    return feed(p, "".join(answer + "\n" for answer in inputs))
 
 
-def check_python_files(test, temp_dir, name, exists=True):
-    base_name = name.split("/")[1]
-    if exists:
-        check_exists = test.assertTrue
-    else:
-        check_exists = test.assertFalse
-    check_exists(isdir(join(temp_dir, base_name, "python")))
-    check_exists(isfile(join(temp_dir, base_name, "python", "setup.py")))
-    check_exists(isfile(join(temp_dir, base_name, "python", "setup.cfg")))
-    check_exists(isfile(join(temp_dir, base_name, "python", "MANIFEST.in")))
-    check_exists(isfile(join(temp_dir, base_name, "python", "requirements.txt")))
-    check_exists(isfile(join(temp_dir, base_name, "python", "spark-package-deps.txt")))
-    check_exists(isfile(join(temp_dir, base_name, "python", "tests.py")))
-
-
-def check_java_files(test, temp_dir, name, exists=True):
+def feed(p, val):
+    """
+    Writes 'val' to the stdin of the process 'p', closes it, and waits for the process to exit.
+    Returns the exit code.
+    """
+    # The process may exit before reading all of its input. Popen.communicate() ignores that too.
+    try:
+        p.stdin.write(val.encode())
+    except BrokenPipeError:
+        pass
+    try:
+        p.stdin.close()
+    except BrokenPipeError:
+        pass
+    return p.wait()
+
+
+def init_cmd(temp_dir, has_scala, has_r, has_python, has_java):
+    langs = []
+    if has_java:
+        langs.append("-j")
+    if has_scala:
+        langs.append("-s")
+    if has_python:
+        langs.append("-p")
+    if has_r:
+        langs.append("-r")
+    return ["init", "-n", "test/trial", "-o", temp_dir] + langs
+
+
+def check_init_layout(temp_dir, has_scala, has_r, has_python, has_java):
+    """
+    Checks the layout of a package created by init with the given language flags.
+    """
+    name = "test/trial"
+    if not has_java and not has_scala and not has_python and not has_r:
+        has_scala = True
+    tree = snapshot_tree(temp_dir)
+    check_layout(tree, name, "base")
+    check_layout(tree, name, "sbt", exists=has_scala or has_java)
+    check_layout(tree, name, "scala", exists=has_scala)
+    check_layout(tree, name, "java", exists=has_java)
+    check_layout(tree, name, "python", exists=has_python)
+    check_layout(tree, name, "r", exists=has_r)
     base_name = name.split("/")[1]
-    if exists:
-        check_exists = test.assertTrue
-    else:
-        check_exists = test.assertFalse
-    check_exists(isdir(join(temp_dir, base_name, "src", "main", "java")))
-    check_exists(isdir(join(temp_dir, base_name, "src", "test", "java")))
+    if has_scala or has_java:
+        assert file_contains(join(temp_dir, base_name, "build.sbt"), 'spName := "%s"' % name)
+    if has_r:
+        assert file_contains(join(temp_dir, base_name, "R", "pkg", "DESCRIPTION"),
+                             "Package: %s" % base_name)
 
 
-def check_r_files(test, temp_dir, name, exists=True):
-    base_name = name.split("/")[1]
-    if exists:
-        check_exists = test.assertTrue
-    else:
-        check_exists = test.assertFalse
-    check_exists(isdir(join(temp_dir, base_name, "R", "pkg", "R")))
-    check_exists(isdir(join(temp_dir, base_name, "R", "pkg", "man")))
-    check_exists(isdir(join(temp_dir, base_name, "R", "pkg", "data")))
-    check_exists(isdir(join(temp_dir, base_name, "R", "pkg", "src")))
-    check_exists(isfile(join(temp_dir, base_name, "R", "pkg", "NAMESPACE")))
-    check_exists(isfile(join(temp_dir, base_name, "R", "pkg", "man", "documentation.Rd")))
-    check_exists(isfile(join(temp_dir, base_name, "R", "pkg", "Read-and-delete-me")))
-    description = join(temp_dir, base_name, "R", "pkg", "DESCRIPTION")
-    check_exists(isfile(description))
-    if exists:
-        with open(description, 'r') as f:
-            test.assertTrue("Package: %s" % base_name in f.read())
-
-
-def clean_dir(test, dir):
-    shutil.rmtree(dir)
-    test.assertFalse(isdir(dir))
-
-
-def check_exception(test, expect, p):
-    out, _ = p.communicate()
-    test.assertTrue(expect in out.decode('utf-8'))
-
-
-def get_licenses():
-    first_lines = [
-        "Apache License, Version 2.0",
-        "Copyright (c) <YEAR>, <OWNER>",
-        "Copyright (c) <YEAR>, <OWNER>",
-        "The GNU General Public License (GPL-2.0)",
-        "GNU GENERAL PUBLIC LICENSE",
-        "GNU Lesser General Public License",
-        "GNU LESSER GENERAL PUBLIC LICENSE",
-        "The MIT License (MIT)",
-        "Mozilla Public License, version 2.0",
-        "Eclipse Public License, Version 1.0 (EPL-1.0)",
-        "# Every Spark Package must have a license in order to be published. You may"
-    ]
-    return [(x[0], x[1], y) for x, y in zip(licenses, first_lines)]
-
-
-class TestCommandLineToolInit(unittest.TestCase):
+class TestCommandLineToolInit:
 
     def test_simple(self):
-        p = run_cmd(["init"])
-        check_exception(self, "Please specify the name of the package using -n or --name.", p)
+        check_exception("Please specify the name of the package using -n or --name.",
+                        invoke_cli(["init"]))
 
     def test_bad_name(self):
-        p = run_cmd(["init", "-n", "noslash"])
-        check_exception(self, "The name of the package must contain exactly one slash.", p)
-        p = run_cmd(["init", "-n", "abc/03/doubleslash"])
-        check_exception(self, "The name of the package must contain exactly one slash.", p)
-        p = run_cmd(["init", "-n", "w3!rd/ch@rs"])
-        check_exception(self, "The name of the package can only contain letters, numbers,", p)
-
-    def test_matrix(self):
-        has_lang_opts = [True, False]
-        i = 0
-        for has_scala in has_lang_opts:
-            for has_r in has_lang_opts:
-                for has_python in has_lang_opts:
-                    for has_java in has_lang_opts:
-                        temp_dir = tempfile.mkdtemp()
-                        name = "test/trial-%s" % i
-                        langs = []
-                        if has_java:
-                            langs.append("-j")
-                        if has_scala:
-                            langs.append("-s")
-                        if has_python:
-                            langs.append("-p")
-                        if has_r:
-                            langs.append("-r")
-                        if not has_java and not has_scala and not has_python and not has_r:
-                            has_scala = True
-                        p = run_cmd(["init", "-n", name, "-o", temp_dir] + langs)
-                        communicate(p, "1")
-                        self.assertTrue(p.returncode == 0)
-                        check_scala_files(self, temp_dir, name, exists=has_scala)
-                        check_base_files(self, temp_dir, name)
-                        check_sbt_files(self, temp_dir, name, exists=has_scala | has_java)
-                        check_python_files(self, temp_dir, name, exists=has_python)
-                        check_r_files(self, temp_dir, name, exists=has_r)
-                        check_java_files(self, temp_dir, name, exists=has_java)
-                        clean_dir(self, temp_dir)
-                        i += 1
-
-    def test_license(self):
-        i = 1
-        for license_name, url, first_line in get_licenses():
-            temp_dir = tempfile.mkdtemp()
-            name = "license-%s" % i
-            p = run_cmd(["init", "-n", "test/" + name, "-o", temp_dir])
-            communicate(p, str(i))
-            check_base_files(self, temp_dir, "test/" + name)
-            if i != len(licenses):
-                with open(join(temp_dir, name, "build.sbt"), "r") as f:
-                    contents = f.read()
-                    self.assertTrue(license_name in contents)
-                    self.assertTrue(url in contents)
-            with open(join(temp_dir, name, "LICENSE"), "r") as f:
-                self.assertTrue(first_line in f.readline())
-            i += 1
-            clean_dir(self, temp_dir)
-
-
-def check_pom(test, pom, org_name, artifact_name, version, dependencies):
+        check_exception("The name of the package must contain exactly one slash.",
+                        invoke_cli(["init", "-n", "noslash"]))
+        check_exception("The name of the package must contain exactly one slash.",
+                        invoke_cli(["init", "-n", "abc/03/doubleslash"]))
+        check_exception("The name of the package can only contain letters, numbers,",
+                        invoke_cli(["init", "-n", "w3!rd/ch@rs"]))
+        check_exception("The name of the package can only contain letters, numbers,",
+                        invoke_cli(["init", "-n", "test/"]))
+
+    @pytest.mark.parametrize("has_scala,has_r,has_python,has_java", [
+        pytest.param(True, False, False, False, id="scala"),
+        pytest.param(False, True, False, False, id="r"),
+        pytest.param(False, False, True, False, id="python"),
+        pytest.param(False, False, False, True, id="java"),
+        pytest.param(True, True, True, True, id="all"),
+        pytest.param(False, False, False, False, id="default"),
+    ])
+    def test_matrix(self, tmp_path, has_scala, has_r, has_python, has_java):
+        temp_dir = str(tmp_path)
+        returncode, _, _ = invoke_cli(init_cmd(temp_dir, has_scala, has_r, has_python, has_java),
+                                      inputs=["1"])
+        assert returncode == 0
+        check_init_layout(temp_dir, has_scala, has_r, has_python, has_java)
+
+    @pytest.mark.slow
+    def test_full_matrix(self, tmp_path):
+        # Each combination runs the installed script in its own process. The processes don't share
+        # any state, so start them all at once and check the results after they're done.
+        cases = [(str(tmp_path / str(i)),) + flags
+                 for i, flags in enumerate(itertools.product([True, False], repeat=4))]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+            returncodes = list(pool.map(lambda case: run_cmd(init_cmd(*case), inputs=["1"]),
+                                        cases))
+        assert returncodes == [0] * len(cases)
+        for case in cases:
+            check_init_layout(*case)
+
+    @pytest.mark.parametrize("i,license_name,url,first_line", license_cases)
+    def test_license(self, tmp_path, i, license_name, url, first_line):
+        temp_dir = str(tmp_path)
+        name = "license-%s" % i
+        cwd = os.getcwd()
+        try:
+            init_empty_package(temp_dir, "test/" + name, scala=True, java=False, python=False,
+                               r=False, license_id=i)
+        finally:
+            os.chdir(cwd)
+        check_layout(snapshot_tree(temp_dir), "test/" + name, "base")
+        if i != len(licenses):
+            assert file_contains(join(temp_dir, name, "build.sbt"), license_name)
+            assert file_contains(join(temp_dir, name, "build.sbt"), url)
+        with open(join(temp_dir, name, "LICENSE"), "r") as f:
+            assert first_line in f.readline()
+
+
+coordinate_regex = re.compile(r"<groupId>\s*([^<]+?)\s*</groupId>\s*"
+                              r"<artifactId>\s*([^<]+?)\s*</artifactId>\s*"
+                              r"<version>\s*([^<]+?)\s*</version>")
+
+
+def check_pom(pom, org_name, artifact_name, version, dependencies):
     """
     Check the contents of the pom. Make sure the groupId, artifactId, and version are properly set.
     :param org_name: organization (group) id of the package
@@ -229,49 +340,48 @@ def check_pom(test, pom, org_name, artifact_name, version, dependencies):
     :param dependencies: List of dependencies expected in the pom
     """
     contents = pom.read().decode('utf-8')
-    def gen_coordinate_regex(org, artifact, v):
-        regex = """<groupId>\\s*%s\\s*<\\/groupId>\\s*""" % org
-        regex += """<artifactId>\\s*%s\\s*<\\/artifactId>\\s*""" % artifact
-        regex += """<version>\\s*%s\\s*<\\/version>""" % v
-        return regex
-    main = gen_coordinate_regex(org_name, artifact_name, version)
-    test.assertTrue(len(re.findall(main, contents)) == 1)
+    found = collections.Counter(coordinate_regex.findall(contents))
+    assert found[(org_name, artifact_name, version)] == 1
     for dep_org, dep_art, dep_version in dependencies:
-        dep = gen_coordinate_regex(dep_org, dep_art, dep_version)
-        test.assertTrue(len(re.findall(dep, contents)) == 1)
+        assert found[(dep_org, dep_art, dep_version)] == 1
     pom.close()
 
-def check_jar(test, jar, files):
+def check_jar(jar, files, absent=()):
     """
-    Check the contents of the pom. Make sure the groupId, artifactId, and version are properly set.
-    :param files: List of entries expected in the jar
+    Check the contents of the jar. Make sure the expected entries exist and aren't corrupt.
+    :param jar: Path or seekable file object of the jar
+    :param files: Entries expected in the jar
+    :param absent: Entries that must not be in the jar
     """
-    jar_file = zipfile.PyZipFile(jar, 'r')
-    entries = jar_file.namelist()
-    for expected in files:
-        test.assertTrue(expected in entries)
-    jar_file.close()
+    with zipfile.ZipFile(jar, 'r') as jar_file:
+        entries = set(jar_file.namelist())
+        assert set(files) - entries == set()
+        assert set(absent) & entries == set()
+        assert jar_file.testzip() is None
 
 
-def check_zip(test, temp_dir, org_name, artifact_name, version, files, dependencies):
+def check_zip(temp_dir, org_name, artifact_name, version, files, dependencies, absent=()):
     """
     Checks if the zip exists and the contents of the pom and jar are valid.
     :param temp_dir: Directory where the zip should exist
     :param org_name: organization (group) id of the package
     :param artifact_name: artifact id of package
     :param version: version of release
-    :param files: List of entries expected in the jar
+    :param files: Entries expected in the jar
     :param dependencies: List of dependencies expected in the pom
+    :param absent: Entries that must not be in the jar
     """
     artifact_format = "%s-%s" % (artifact_name, version)
     zip = join(temp_dir, artifact_format + ".zip" )
-    test.assertTrue(isfile(zip))
-    with zipfile.PyZipFile(zip, 'r') as myzip:
+    assert isfile(zip)
+    with zipfile.ZipFile(zip, 'r') as myzip:
         entries = myzip.namelist()
-        test.assertTrue(artifact_format + ".pom" in entries)
-        test.assertTrue(artifact_format + ".jar" in entries)
-        check_jar(test, myzip.extract(artifact_format + ".jar", temp_dir), files)
-        check_pom(test, myzip.open(artifact_format + ".pom"),
+        assert artifact_format + ".pom" in entries
+        assert artifact_format + ".jar" in entries
+        # Read the jar straight out of the zip rather than extracting it to disk first
+        with myzip.open(artifact_format + ".jar") as jar:
+            check_jar(jar, files, absent)
+        check_pom(myzip.open(artifact_format + ".pom"),
                   org_name, artifact_name, version, dependencies)
 
 
@@ -280,12 +390,46 @@ def write_file(path, contents):
         f.write(contents)
 
 
-def create_jar(temp_dir, artifact_name, version, files):
-    jar = zipfile.PyZipFile(join(temp_dir, artifact_name,
-                                 "%s-%s.jar" % (artifact_name, version)), 'w')
-    for f in files:
-        jar.write(f, f.replace(temp_dir, ""))
-    jar.close()
+def create_jar(temp_dir, artifact_name, version, files, compression=zipfile.ZIP_STORED):
+    with zipfile.ZipFile(join(temp_dir, artifact_name, "%s-%s.jar" % (artifact_name, version)),
+                         'w', compression) as jar:
+        for f in files:
+            jar.write(f, arcname=f.replace(temp_dir, ""))
+
+
+def write_jar(path, entries):
+    """
+    Writes a jar at 'path' holding an empty file for each name in 'entries'.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with zipfile.ZipFile(path, 'w') as jar:
+        for entry in entries:
+            jar.writestr(entry, "")
+
+
+def write_jar_from_host(path, entries, create_system, external_attr):
+    """
+    Writes a jar at 'path' the way a tool on another host would. 'entries' maps the names of the
+    entries to their compression. Every entry gets 'create_system' and 'external_attr'.
+    """
+    with zipfile.ZipFile(path, 'w') as jar:
+        for entry, compression in entries.items():
+            jar.writestr(entry, "hulahulahulahey", compression)
+        # zipfile fills in a default mode while writing, so set the attributes afterwards. They
+        # only go to the central directory, which is written on close.
+        for info in jar.infolist():
+            info.create_system = create_system
+            info.external_attr = external_attr
+
+
+def zipped_jar_infos(temp_dir, artifact_name, version):
+    """
+    Returns the ZipInfo of every entry in the jar inside the release zip, by name.
+    """
+    artifact_format = "%s-%s" % (artifact_name, version)
+    with zipfile.ZipFile(join(temp_dir, artifact_format + ".zip")) as myzip, \
+            myzip.open(artifact_format + ".jar") as jar, zipfile.ZipFile(jar) as jar_file:
+        return {info.filename: info for info in jar_file.infolist()}
 
 
 def create_pom(temp_dir, group_id, artifact_id, version):
@@ -303,103 +447,245 @@ def create_pom(temp_dir, group_id, artifact_id, version):
     write_file(join(temp_dir, "pom.xml"), contents)
 
 
-class TestCommandLineToolZip(unittest.TestCase):
+# Entries zip adds to the jar for the python part of the scaffold
+python_jar_contents = frozenset(("setup.pyc", "requirements.txt", "tests.pyc"))
+
 
-    def test_zip_missing_args(self):
-        temp_dir = tempfile.mkdtemp()
+@pytest.fixture(scope="session")
+def scaffold_template(tmp_path_factory):
+    """
+    Returns a function that copies an initialized package into a directory. The package is built
+    by `init` only once per combination of language flags and then reused by every test.
+    """
+    templates = {}
+
+    def copy_scaffold(temp_dir, name, *langs):
+        base_name = name.split("/")[1]
+        if (name, langs) not in templates:
+            template_dir = str(tmp_path_factory.mktemp("scaffold"))
+            returncode, _, _ = invoke_cli(["init", "-n", name, "-o", template_dir] + list(langs),
+                                          inputs=["1"])
+            assert returncode == 0
+            if "-p" in langs:
+                # zip puts compiled python files in the jar. Compile them here, once, and the
+                # copies below carry the up-to-date __pycache__ along with their sources.
+                assert compileall.compile_dir(join(template_dir, base_name, "python"), quiet=1)
+            templates[(name, langs)] = template_dir
+        shutil.copytree(join(templates[(name, langs)], base_name), join(temp_dir, base_name))
+    return copy_scaffold
+
+
+class TestCommandLineToolZip:
+
+    def test_zip_missing_args(self, tmp_path, scaffold_template):
+        temp_dir = str(tmp_path)
         name = "test/zip-test"
-        p = run_cmd(["init", "-n", name, "-o", temp_dir])
-        communicate(p, "1")
-        p = run_cmd(["zip"])
-        check_exception(self, "Please specify the name of the package using -n or --name", p)
-        p = run_cmd(["zip", "-n", name])
-        check_exception(self, "Please specify the folder of the spark package", p)
-        p = run_cmd(["zip", "-n", name, "-f", join(temp_dir, "zip-test")])
-        check_exception(self, "Please specify a version for the release", p)
-        clean_dir(self, temp_dir)
+        scaffold_template(temp_dir, name)
+        check_exception("Please specify the name of the package using -n or --name",
+                        invoke_cli(["zip"]))
+        check_exception("Please specify the folder of the spark package",
+                        invoke_cli(["zip", "-n", name]))
+        check_exception("Please specify a version for the release",
+                        invoke_cli(["zip", "-n", name, "-f", join(temp_dir, "zip-test")]))
 
     def test_zip_bad_names(self):
-        p = run_cmd(["zip", "-n", "noslash"])
-        check_exception(self, "The name of the package must contain exactly one slash.", p)
-        p = run_cmd(["zip", "-n", "abc/03/doubleslash"])
-        check_exception(self, "The name of the package must contain exactly one slash.", p)
-        p = run_cmd(["zip", "-n", "w3!rd/ch@rs"])
-        check_exception(self, "The name of the package can only contain letters, numbers,", p)
-
-    def test_zip_proper(self):
-        temp_dir = tempfile.mkdtemp()
+        check_exception("The name of the package must contain exactly one slash.",
+                        invoke_cli(["zip", "-n", "noslash"]))
+        check_exception("The name of the package must contain exactly one slash.",
+                        invoke_cli(["zip", "-n", "abc/03/doubleslash"]))
+        check_exception("The name of the package can only contain letters, numbers,",
+                        invoke_cli(["zip", "-n", "w3!rd/ch@rs"]))
+
+    def test_zip_proper(self, tmp_path, scaffold_template):
+        temp_dir = str(tmp_path)
         org_name = "test"
         base_name = "zip-test"
         name = org_name + "/" + base_name
-        p = run_cmd(["init", "-n", name, "-o", temp_dir, "-p"])
-        out, err = communicate(p, "1")
+        scaffold_template(temp_dir, name, "-p")
         version = "0.2"
-        p = run_cmd(["zip", "-n", name, "-o", temp_dir, "-v", version,
-                     "-f", join(temp_dir, base_name)])
-        # p.wait()
-        out, err = p.communicate()
-        jar_contents = ["setup.pyc", "requirements.txt", "tests.pyc"]
-        check_zip(self, temp_dir, org_name, base_name, version, files=jar_contents, dependencies=[])
-        clean_dir(self, temp_dir)
-
-    def test_zip_existing_jar(self):
-        temp_dir = tempfile.mkdtemp()
+        returncode, _, _ = invoke_cli(["zip", "-n", name, "-o", temp_dir, "-v", version,
+                                       "-f", join(temp_dir, base_name)])
+        assert returncode == 0
+        check_zip(temp_dir, org_name, base_name, version, files=python_jar_contents,
+                  dependencies=[])
+
+    @pytest.mark.parametrize("compression", [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED])
+    def test_zip_existing_jar(self, tmp_path, scaffold_template, compression):
+        temp_dir = str(tmp_path)
         org_name = "test"
         base_name = "zip-test"
         name = org_name + "/" + base_name
-        p = run_cmd(["init", "-n", name, "-o", temp_dir, "-p", "-s"])
-        communicate(p, "1")
+        scaffold_template(temp_dir, name, "-p", "-s")
         version = "0.2"
         test1 = join(temp_dir, "test.class")
         test2 = join(temp_dir, "test2.class")
         write_file(join(temp_dir, "test.class"), "hulahulahulahey")
         write_file(join(temp_dir, "test2.class"), "hulahulahulaheyheyhey")
-        create_jar(temp_dir, base_name, version, [test1, test2])
-        self.assertTrue(isfile(join(temp_dir, base_name, "%s-%s.jar" % (base_name, version))))
+        create_jar(temp_dir, base_name, version, [test1, test2], compression)
+        assert isfile(join(temp_dir, base_name, "%s-%s.jar" % (base_name, version)))
         create_pom(join(temp_dir, base_name), "org.test", base_name, version)
-        self.assertTrue(isfile(join(temp_dir, base_name, "pom.xml")))
-        p = run_cmd(["zip", "-n", name, "-o", temp_dir, "-v", version,
-                     "-f", join(temp_dir, base_name)])
-        p.wait()
-        jar_contents = ["setup.pyc", "requirements.txt", "tests.pyc", "test.class", "test2.class"]
-        check_zip(self, temp_dir, org_name, base_name, version, files=jar_contents, dependencies=[])
-        clean_dir(self, temp_dir)
-
-    def test_zip_python_dependencies(self):
-        temp_dir = tempfile.mkdtemp()
+        assert isfile(join(temp_dir, base_name, "pom.xml"))
+        returncode, _, _ = invoke_cli(["zip", "-n", name, "-o", temp_dir, "-v", version,
+                                       "-f", join(temp_dir, base_name)])
+        assert returncode == 0
+        jar_contents = python_jar_contents | {"test.class", "test2.class"}
+        check_zip(temp_dir, org_name, base_name, version, files=jar_contents, dependencies=[])
+
+    def test_zip_existing_jar_streamed_entry(self, tmp_path, scaffold_template, monkeypatch):
+        temp_dir = str(tmp_path)
+        org_name = "test"
+        base_name = "zip-test"
+        name = org_name + "/" + base_name
+        scaffold_template(temp_dir, name, "-s")
+        version = "0.2"
+        # A stored entry can't be copied raw into the deflated jar, so it's streamed through zipfile
+        # in chunks of copy_buffer_size. Shrink the chunks so the entry takes many of them.
+        monkeypatch.setattr(spark_package, "copy_buffer_size", 1024)
+        data = os.urandom(64 * 1024 + 1)
+        with zipfile.ZipFile(join(temp_dir, base_name, "%s-%s.jar" % (base_name, version)),
+                             'w', zipfile.ZIP_STORED) as jar:
+            jar.writestr("Large.class", data)
+        returncode, _, _ = invoke_cli(["zip", "-n", name, "-o", temp_dir, "-v", version,
+                                       "-f", join(temp_dir, base_name)])
+        assert returncode == 0
+        check_zip(temp_dir, org_name, base_name, version, files=["Large.class"], dependencies=[])
+        artifact_format = "%s-%s" % (base_name, version)
+        with zipfile.ZipFile(join(temp_dir, artifact_format + ".zip")) as myzip, \
+                myzip.open(artifact_format + ".jar") as jar, zipfile.ZipFile(jar) as jar_file:
+            assert jar_file.read("Large.class") == data
+
+    @pytest.mark.parametrize("create_system,external_attr,expected", [
+        # Windows tools write DOS attributes, here the archive bit, which only make sense together
+        # with the DOS host
+        pytest.param(0, 0x20, (0, 0x20), id="dos-attributes"),
+        # The JDK, sbt and Maven write no attributes and an MS-DOS host, which would extract with no
+        # permissions
+        pytest.param(0, 0, (3, 0o600 << 16), id="jdk"),
+    ])
+    def test_zip_existing_jar_modes(self, tmp_path, scaffold_template, create_system,
+                                    external_attr, expected):
+        temp_dir = str(tmp_path)
+        base_name = "zip-test"
+        name = "test/" + base_name
+        scaffold_template(temp_dir, name, "-s")
+        version = "0.2"
+        entries = {"Deflated.class": zipfile.ZIP_DEFLATED, "Stored.class": zipfile.ZIP_STORED}
+        write_jar_from_host(join(temp_dir, base_name, "%s-%s.jar" % (base_name, version)),
+                            entries, create_system, external_attr)
+        returncode, _, _ = invoke_cli(["zip", "-n", name, "-o", temp_dir, "-v", version,
+                                       "-f", join(temp_dir, base_name)])
+        assert returncode == 0
+        infos = zipped_jar_infos(temp_dir, base_name, version)
+        for entry in entries:
+            assert (infos[entry].create_system, infos[entry].external_attr) == expected, entry
+
+    @pytest.mark.parametrize("jars,found,ignored", [
+        # Jars under lib/ are dependencies, not the package jar
+        pytest.param({"zip-test-0.2.jar": "Package.class", join("lib", "dep-1.0.jar"): "Dep.class"},
+                     "Package.class", ["Dep.class"], id="lib-dir"),
+        # The sbt launcher and assembly jars are build outputs that aren't the package jar
+        pytest.param({join("target", "zip-test-0.2.jar"): "Package.class",
+                      join("build", "sbt-launch-0.13.7.jar"): "Launcher.class",
+                      join("target", "zip-test-assembly-0.2.jar"): "Assembly.class"},
+                     "Package.class", ["Launcher.class", "Assembly.class"], id="sbt-and-assembly"),
+        # Only directories named lib are skipped, not jars that have "lib" in their name
+        pytest.param({join("target", "scala-2.10", "mylibrary_2.10-0.1.jar"): "Library.class"},
+                     "Library.class", [], id="lib-in-jar-name"),
+    ])
+    def test_zip_finds_package_jar(self, tmp_path, scaffold_template, jars, found, ignored):
+        temp_dir = str(tmp_path)
         org_name = "test"
         base_name = "zip-test"
         name = org_name + "/" + base_name
-        p = run_cmd(["init", "-n", name, "-o", temp_dir, "-p"])
-        communicate(p, "1")
+        scaffold_template(temp_dir, name, "-s")
         version = "0.2"
-        deps_file = join(temp_dir, base_name, "python", "spark-package-deps.txt")
-        write_file(deps_file, """wrong/format\n""")
-        p = run_cmd(["zip", "-n", name, "-o", temp_dir, "-v", version,
-                     "-f", join(temp_dir, base_name)])
-        check_exception(self, ":package_name==:version` in spark-package-deps.txt", p)
-        write_file(deps_file, """wrong:format==2\n""")
-        p = run_cmd(["zip", "-n", name, "-o", temp_dir, "-v", version,
-                     "-f", join(temp_dir, base_name)])
-        check_exception(self, "supplied as: `:repo_owner_name/:repo_name` in", p)
-
-        write_file(deps_file, """right/format==3\n""")
-        p = run_cmd(["zip", "-n", name, "-o", temp_dir, "-v", version,
-                     "-f", join(temp_dir, base_name)])
-        p.wait()
-        jar_contents = ["setup.pyc", "requirements.txt", "tests.pyc"]
-        check_zip(self, temp_dir, org_name, base_name, version,
-                  files=jar_contents, dependencies=[("right", "format", "3")])
-        clean_dir(self, temp_dir)
-
-
-class TestCommandLineToolRegister(unittest.TestCase):
+        for path, entry in jars.items():
+            write_jar(join(temp_dir, base_name, path), [entry])
+        returncode, out, _ = invoke_cli(["zip", "-n", name, "-o", temp_dir, "-v", version,
+                                         "-f", join(temp_dir, base_name)])
+        assert returncode == 0, out
+        check_zip(temp_dir, org_name, base_name, version, files=[found], dependencies=[],
+                  absent=ignored)
+
+    def test_zip_ignores_lib_only_jar(self, tmp_path, scaffold_template):
+        temp_dir = str(tmp_path)
+        name = "test/zip-test"
+        scaffold_template(temp_dir, name, "-s")
+        write_jar(join(temp_dir, "zip-test", "lib", "dep-1.0.jar"), ["Dep.class"])
+        check_exception("a jar could not be found",
+                        invoke_cli(["zip", "-n", name, "-o", temp_dir, "-v", "0.2",
+                                    "-f", join(temp_dir, "zip-test")]))
+
+    def test_zip_python_subdirs(self, tmp_path, scaffold_template):
+        temp_dir = str(tmp_path)
+        org_name = "test"
+        base_name = "zip-test"
+        name = org_name + "/" + base_name
+        scaffold_template(temp_dir, name, "-p")
+        version = "0.2"
+        # Only directories whose whole name is excluded are skipped
+        for package in ["lib", "docs", "library"]:
+            os.makedirs(join(temp_dir, base_name, "python", package))
+            write_file(join(temp_dir, base_name, "python", package, "__init__.py"), "")
+        returncode, _, _ = invoke_cli(["zip", "-n", name, "-o", temp_dir, "-v", version,
+                                       "-f", join(temp_dir, base_name)])
+        assert returncode == 0
+        check_zip(temp_dir, org_name, base_name, version,
+                  files=python_jar_contents | {"library/__init__.pyc"}, dependencies=[],
+                  absent=["lib/__init__.pyc", "docs/__init__.pyc"])
+
+    @pytest.mark.parametrize("deps,expect", [
+        ("wrong/format\n", ":package_name==:version` in spark-package-deps.txt"),
+        ("wrong:format==2\n", "supplied as: `:repo_owner_name/:repo_name` in"),
+        ("# comments and blank lines are skipped\n\nright/format==3\n", None),
+    ])
+    def test_zip_python_dependencies(self, tmp_path, scaffold_template, deps, expect):
+        temp_dir = str(tmp_path)
+        org_name = "test"
+        base_name = "zip-test"
+        name = org_name + "/" + base_name
+        scaffold_template(temp_dir, name, "-p")
+        version = "0.2"
+        write_file(join(temp_dir, base_name, "python", "spark-package-deps.txt"), deps)
+        result = invoke_cli(["zip", "-n", name, "-o", temp_dir, "-v", version,
+                             "-f", join(temp_dir, base_name)])
+        if expect is not None:
+            check_exception(expect, result)
+        else:
+            assert result[0] == 0
+            check_zip(temp_dir, org_name, base_name, version,
+                      files=python_jar_contents, dependencies=[("right", "format", "3")])
+
+
+class TestCommandLineToolRegister:
 
     def test_register_bad_args(self):
-        p = run_cmd(["register"])
-        check_exception(self, "Please specify the name of the package using -n or --name", p)
+        check_exception("Please specify the name of the package using -n or --name",
+                        invoke_cli(["register"]))
 
     def test_ask_git_creds(self):
+        prompts = []
+
+        def answer(answers):
+            answers = iter(answers)
+            def prompt(text):
+                prompts.append(text)
+                return next(answers)
+            return prompt
+
+        creds = resolve_credentials(None, None, None, input_fn=answer([" git-user "]),
+                                    getpass_fn=answer(["git-password\n"]))
+        assert creds == ("git-user", "git-password")
+        assert prompts == [
+            "Please enter your Github username: ",
+            "Please enter your Github Personal access token with read:org permissions: "]
+        # Supplied credentials are used without prompting
+        creds = resolve_credentials("user", "token", None, input_fn=answer([]),
+                                    getpass_fn=answer([]))
+        assert creds == ("user", "token")
+        assert len(prompts) == 2
+
+    def test_register_prompts_smoke(self):
         p = spawn(["register", "-n", "test/register"])
         input_and_expect(p, [
             (b"Please enter your Github username.*", "git-user"),
@@ -407,18 +693,75 @@ class TestCommandLineToolRegister(unittest.TestCase):
             (b"Please supply a short \(one line\) description of.*", None)])
         p.kill(0)
 
-    @responses.activate
-    def test_simple_register(self):
-        responses.add(
-            responses.POST, 'https://spark-packages.org/api/submit-package',
+    def test_simple_register(self, network):
+        network.add(
+            "POST", 'https://spark-packages.org/api/submit-package',
             body="",
             status=201)
         register_package_http("test/register", "fake", "token", "short", "long", "http://homepage")
-        self.assertTrue(len(responses.calls) == 1)
-        self.assertTrue(responses.calls[0].request.url ==
-                        'https://spark-packages.org/api/submit-package')
+        assert len(network.calls) == 1
+        assert network.calls[0].request.url == 'https://spark-packages.org/api/submit-package'
 
+    def test_read_credentials_file(self, tmp_path):
+        temp_dir = str(tmp_path)
+        creds = join(temp_dir, "creds")
+        write_file(creds, "# password=commented-out\nuser = git-user\n\npassword=git-token\n")
+        assert read_credentials_file(creds) == ("git-user", "git-token")
+
+
+def git(repo, *args):
+    """
+    Runs a git command in 'repo' and returns its output.
+    """
+    return subprocess.run(["git", "-c", "user.name=test", "-c", "user.email=test@example.com"] +
+                          list(args), cwd=repo, check=True, stdout=subprocess.PIPE,
+                          stderr=subprocess.DEVNULL, universal_newlines=True).stdout.strip()
+
+
+class TestCommandLineToolPublish:
+
+    @pytest.fixture
+    def package(self, tmp_path, scaffold_template, monkeypatch):
+        """
+        Returns the name and folder of a fresh python package. Git doesn't look for a repository
+        above the test directory, so the package is only in one if the test creates it.
+        """
+        monkeypatch.setenv("GIT_CEILING_DIRECTORIES", str(tmp_path))
+        name = "test/publish-test"
+        scaffold_template(str(tmp_path), name, "-p")
+        return name, join(str(tmp_path), "publish-test")
+
+    def publish(self, name, folder):
+        return invoke_cli(["publish", "-n", name, "-f", folder, "-v", "0.1", "-o", folder,
+                           "-u", "git-user", "-t", "git-token"], inputs=["1"])
+
+    def test_publish(self, network, package):
+        name, folder = package
+        git(folder, "init", "-q")
+        git(folder, "add", "-A")
+        git(folder, "commit", "-q", "-m", "Initial commit")
+        sha = git(folder, "rev-parse", "HEAD")
+        network.add("POST", 'https://spark-packages.org/api/submit-release', body="", status=201)
+        returncode, out, _ = self.publish(name, folder)
+        assert returncode == 0, out
+        assert "SUCCESS" in out
+        assert len(network.calls) == 1
+        body = network.calls[0].request.body
+        assert b'name="git_commit_sha1"\r\n\r\n' + sha.encode() in body
+
+    def test_publish_not_a_git_repo(self, network, package):
+        name, folder = package
+        check_exception("Problem while accessing git commit sha.", self.publish(name, folder))
+        assert len(network.calls) == 0
+
+    @pytest.mark.parametrize("size", [0, 1000, 2 * base64_chunk_size + 1000],
+                             ids=["empty", "not-multiple-of-3", "multiple-chunks"])
+    def test_encode_file_base64(self, tmp_path, size):
+        data = os.urandom(size)
+        path = tmp_path / "artifact.zip"
+        path.write_bytes(data)
+        assert encode_file_base64(str(path)) == base64.b64encode(data)
 
 
 if __name__ == '__main__':
-    unittest.main()
+    sys.exit(pytest.main([__file__]))